@@ -3,38 +3,59 @@
 
 #This file defines the LangGraph workflow using the nodes from agent_nodes.py.
 
-from langgraph.graph import StateGraph, END
+import asyncio
+from langgraph.graph import StateGraph, START, END
+from langgraph.types import Send
+from utils import warm_up_gcs
 from agent_nodes import (
     PublicSpeakingState,
+    node_prewarm,
     node_extract_audio,
-    node_transcribe_audio,
-    node_coach_feedback,
-    node_synthesize_audio_feedback
+    node_transcribe_chunk,
+    node_merge_transcript,
+    node_stream_coach_and_tts
 )
 
+def route_audio_chunks(state: PublicSpeakingState) -> list[Send]:
+    """Fans out one transcribe_chunk run per extracted audio chunk (map step)."""
+    return [
+        Send("transcribe_chunk", {"chunk": chunk, "index": i})
+        for i, chunk in enumerate(state['audio_chunks'])
+    ]
+
 def build_public_speaking_coach_graph():
     """Builds and compiles the LangGraph workflow for the public speaking coach."""
+    # Pay the GCS auth/TLS setup now rather than on the first request
+    warm_up_gcs()
+
     workflow = StateGraph(PublicSpeakingState)
 
     # Add nodes to the graph
+    workflow.add_node("prewarm", node_prewarm)
     workflow.add_node("extract_audio", node_extract_audio)
-    workflow.add_node("transcribe_audio", node_transcribe_audio)
-    workflow.add_node("coach_feedback", node_coach_feedback)
-    workflow.add_node("synthesize_audio_feedback", node_synthesize_audio_feedback)
+    workflow.add_node("transcribe_chunk", node_transcribe_chunk)
+    workflow.add_node("merge_transcript", node_merge_transcript)
+    workflow.add_node("stream_coach_and_tts", node_stream_coach_and_tts)
 
     # Define the execution flow (edges)
     workflow.set_entry_point("extract_audio")
-    workflow.add_edge("extract_audio", "transcribe_audio")
-    workflow.add_edge("transcribe_audio", "coach_feedback")
-    workflow.add_edge("coach_feedback", "synthesize_audio_feedback")
-    workflow.add_edge("synthesize_audio_feedback", END)
+    # prewarm runs in the same superstep as extract_audio, hiding connection warm-up behind ffmpeg
+    workflow.add_edge(START, "prewarm")
+    # Transcription is a map-reduce: every chunk is transcribed in parallel and the
+    # results are fanned back in (through the transcript_parts reducer) by merge_transcript
+    workflow.add_conditional_edges("extract_audio", route_audio_chunks, ["transcribe_chunk"])
+    workflow.add_edge("transcribe_chunk", "merge_transcript")
+    # Feedback generation and speech synthesis are pipelined within a single node,
+    # which waits for both the transcript and the warm-up to finish
+    workflow.add_edge(["merge_transcript", "prewarm"], "stream_coach_and_tts")
+    workflow.add_edge("stream_coach_and_tts", END)
 
     # Compile the graph
     app = workflow.compile()
     return app
 
-if __name__ == "__main__":
-    # This block allows you to test the graph standalone (e.g., with a dummy GCS URI)
+async def main():
+    # This allows you to test the graph standalone (e.g., with a dummy GCS URI)
     print("Building and testing the LangGraph workflow...")
     graph = build_public_speaking_coach_graph()
 
@@ -46,26 +67,32 @@ if __name__ == "__main__":
     # and ensure `ffmpeg` is installed locally if running outside of Cloud Run.
     # Also ensure your GCP_PROJECT_ID and GCS_BUCKET_NAME are set in agent_nodes.py and utils.py
 
-    # The graph.stream() method yields state updates as it progresses
+    # The nodes are coroutines, so the graph is driven with graph.astream().
+    # stream_mode="values" yields the full state after every step
     print("Running graph...")
     try:
         final_state = None
-        for s in graph.stream(initial_state):
-            print(s) # Print intermediate states
+        async for s in graph.astream(initial_state, stream_mode="values"):
+            print({key: value for key, value in s.items() if key != 'audio_chunks'}) # Print intermediate states (minus the raw audio)
             final_state = s
 
         print("\n--- Final State ---")
-        print(f"Transcript: {final_state['coach_feedback']['transcript']}")
-        print(f"Feedback Text: {final_state['coach_feedback']['feedback_text']}")
-        print(f"Feedback Audio URI: {final_state['synthesize_audio_feedback']['feedback_audio_gcs_uri']}")
+        print(f"Transcript: {final_state['transcript']}")
+        print(f"Feedback Text: {final_state['feedback_text']}")
+        print(f"Feedback Audio URI: {final_state['feedback_audio_gcs_uri']}")
         print("Graph execution complete.")
 
         # Optional: Delete the temporary GCS files after testing
         # from utils import delete_gcs_blob
-        # delete_gcs_blob(final_state['extract_audio']['extracted_audio_gcs_uri'])
-        # delete_gcs_blob(final_state['synthesize_audio_feedback']['feedback_audio_gcs_uri'])
+        # for chunk in final_state['audio_chunks']:
+        #     if isinstance(chunk, str):
+        #         delete_gcs_blob(chunk)
+        # delete_gcs_blob(final_state['feedback_audio_gcs_uri'])
 
     except Exception as e:
         print(f"An error occurred during graph execution: {e}")
         print("Please ensure you have valid Google Cloud credentials, project ID, bucket name, and necessary services enabled.")
-        print("Also, check if FFmpeg is installed and accessible if you're testing locally.")
\ No newline at end of file
+        print("Also, check if FFmpeg is installed and accessible if you're testing locally.")
+
+if __name__ == "__main__":
+    asyncio.run(main())
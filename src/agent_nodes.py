@@ -1,19 +1,45 @@
 # agent_nodes.py
-import os
+import asyncio
+import functools
+import hashlib
+import io
+import operator
 import uuid
-from typing import TypedDict, Optional
+from datetime import timedelta
+from typing import Annotated, AsyncIterator, TypedDict, Optional, Union
 from google.cloud import speech_v1p1beta1 as speech
 from google.cloud import texttospeech
 from langchain_core.messages import HumanMessage
+from langchain_core.prompts import ChatPromptTemplate
 from langchain_google_genai import ChatGoogleGenerativeAI
+from langgraph.config import get_stream_writer
 import re # Import regular expression module
 
-from utils import download_from_gcs, upload_to_gcs, extract_audio_from_video, GCS_BUCKET_NAME
+from utils import (
+    upload_bytes_to_gcs, stream_audio_chunks_from_gcs,
+    read_text_from_gcs, write_text_to_gcs, AUDIO_FORMATS, GCS_BUCKET_NAME
+)
 
 # --- Configuration ---
 # GCP_PROJECT_ID is still defined here for reference, but not directly passed to ChatGoogleGenerativeAI
 GCP_PROJECT_ID = "dogwood-site-467123-v3" # <<< Ensure this is your correct project ID
 GEMINI_MODEL_NAME = "gemini-1.5-flash" # Use 'gemini-1.5-pro' for higher quality, 'gemini-1.5-flash' for speed/cost
+# Extracted audio is split into chunks of this length and transcribed in parallel. Kept below
+# SYNC_RECOGNIZE_MAX_SECONDS, since segmented chunks run slightly past their nominal length.
+AUDIO_CHUNK_SECONDS = 55
+AUDIO_CHUNK_FORMAT = "ogg_opus" # Encoding of the audio chunks (one of utils.SEGMENTED_AUDIO_FORMATS); "wav" for lossless
+SYNC_RECOGNIZE_MAX_SECONDS = 60 # Longest audio Speech-to-Text accepts in a synchronous recognize request
+PREWARM_TIMEOUT_SECONDS = 5 # Warm-ups still pending after this are abandoned, so they never hold up coaching
+INLINE_AUDIO_MAX_BYTES = 10 * 1024 * 1024 # Largest audio Speech-to-Text accepts inline; bigger chunks are staged in GCS
+FEEDBACK_CACHE_PREFIX = "feedback_cache" # GCS prefix for cached Gemini feedback, keyed by transcript hash
+# Cached feedback older than this is ignored; gcs-lifecycle.json deletes it from the bucket after the same age
+FEEDBACK_CACHE_TTL = timedelta(days=30)
+# Streamed feedback is sent to Text-to-Speech at sentence ends; a period after a digit (list
+# numbers like "1.") or ending a common abbreviation does not end a sentence
+SENTENCE_END_PATTERN = re.compile(r'(?<!\d)(?<!\be\.g)(?<!\bi\.e)(?<!\bvs)(?<!\bMr)(?<!\bMs)(?<!\bDr)[.!?]\s')
+TTS_MIN_SEGMENT_CHARS = 80 # Sentences are merged up to this length before synthesis, so short fragments do not cost a request each
+FEEDBACK_MIN_OUTPUT_TOKENS = 512 # Gemini output budget for the shortest transcripts; fits all three feedback sections
+FEEDBACK_MAX_OUTPUT_TOKENS = 1024 # Gemini output budget for long transcripts (and the model default)
 
 # TEMPORARY API KEY FOR LOCAL TESTING
 # IMPORTANT: GENERATE THIS API KEY IN GOOGLE CLOUD CONSOLE (APIs & Services -> Credentials -> Create Credentials -> API Key)
@@ -23,10 +49,40 @@ GEMINI_MODEL_NAME = "gemini-1.5-flash" # Use 'gemini-1.5-pro' for higher quality
 GOOGLE_API_KEY = "YOUR_GENERATED_GEMINI_API_KEY_HERE" # <<< PASTE YOUR API KEY HERE
 
 
-# Initialize Google Cloud API clients
-# These clients will now use GOOGLE_APPLICATION_CREDENTIALS for authentication in Docker
-speech_client = speech.SpeechClient()
-tts_client = texttospeech.TextToSpeechClient()
+# Speech-to-Text encoding for each audio chunk format (see utils.SEGMENTED_AUDIO_FORMATS)
+STT_ENCODINGS = {
+    "wav": speech.RecognitionConfig.AudioEncoding.LINEAR16,
+    "ogg_opus": speech.RecognitionConfig.AudioEncoding.OGG_OPUS,
+}
+
+# Google Cloud API clients
+# These clients will now use GOOGLE_APPLICATION_CREDENTIALS for authentication in Docker.
+# The async (grpc.aio) clients bind to the event loop that is running when they are
+# created, so they are built lazily on first use instead of at import time.
+@functools.lru_cache(maxsize=None)
+def get_speech_client() -> speech.SpeechAsyncClient:
+    return speech.SpeechAsyncClient()
+
+@functools.lru_cache(maxsize=None)
+def get_tts_client() -> texttospeech.TextToSpeechAsyncClient:
+    return texttospeech.TextToSpeechAsyncClient()
+
+_api_clients_warmed_up = False # Set by node_prewarm after its first run in this process
+
+async def warm_up_clients():
+    """
+    Opens the Speech-to-Text and Text-to-Speech gRPC channels ahead of the first request.
+    Must be awaited on the event loop that will run the graph. Gives up after PREWARM_TIMEOUT_SECONDS,
+    since channel_ready() keeps waiting through connection failures.
+    """
+    try:
+        await asyncio.wait_for(asyncio.gather(
+            get_speech_client().transport.grpc_channel.channel_ready(),
+            get_tts_client().transport.grpc_channel.channel_ready(),
+        ), timeout=PREWARM_TIMEOUT_SECONDS)
+        print("Speech-to-Text and Text-to-Speech channels ready.")
+    except Exception as e:
+        print(f"Could not warm up Speech-to-Text/Text-to-Speech channels: {e}")
 
 # Initialize LangChain's wrapper for Gemini API
 # FIX: Removed the 'project_id' argument from ChatGoogleGenerativeAI initialization.
@@ -34,122 +90,187 @@ tts_client = texttospeech.TextToSpeechClient()
 gemini_llm = ChatGoogleGenerativeAI(
     model=GEMINI_MODEL_NAME,
     temperature=0.7, # Controls randomness: 0.0 (deterministic) to 1.0 (creative)
-    max_output_tokens=1024, # Limit output length for feedback
+    max_output_tokens=FEEDBACK_MAX_OUTPUT_TOKENS, # Limit output length for feedback; narrowed per transcript by get_coach_chain
     google_api_key=GOOGLE_API_KEY # Explicitly pass the API key here
 )
 
+# Static coaching instructions, sent as the system prompt of every feedback request.
+# Keeping them out of the per-call message means each request only carries the transcript and its target length.
+COACH_SYSTEM_PROMPT = """
+You are an expert public speaking coach. Your goal is to provide constructive, actionable, and encouraging feedback on the public speaking transcript you are given.
+The feedback should be suitable for audio delivery, so keep sentences clear and concise.
+
+Focus on these three main sections:
+1.  **Strengths:** Identify 2-3 specific positive aspects of the speaker's delivery based on the transcript. Examples: "Your opening was engaging," "You used clear and concise language," "Your points flowed logically."
+2.  **Areas for Improvement:** Identify 2-3 specific, actionable suggestions for improvement. Examples: "Consider reducing filler words like 'um' or 'uh'," "Try varying your vocal pace to emphasize key points," "Ensure your conclusion clearly summarizes your main message."
+3.  **Overall Encouragement:** End with a brief, positive, and motivating statement.
+
+The transcript of the speech is enclosed in triple backticks. It comes straight from speech recognition without punctuation or capitalization, so infer the sentence boundaries yourself; do not comment on the missing punctuation.
+Please provide your feedback in a natural, conversational, and supportive tone.
+"""
+
+# Per-request message: the target length (derived from the output token budget, so Gemini plans
+# its answer to fit instead of being cut off) and the transcript
+COACH_HUMAN_PROMPT = "Keep your feedback under {word_limit} words.\n\n```\n{transcript}\n```"
+
+# The prompt template is compiled once; only the transcript and output budget vary per call
+COACH_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", COACH_SYSTEM_PROMPT),
+    ("human", COACH_HUMAN_PROMPT),
+])
+
+@functools.lru_cache(maxsize=None)
+def get_coach_chain(max_output_tokens: int = FEEDBACK_MAX_OUTPUT_TOKENS):
+    """
+    Returns the coaching chain for an output token budget, built once per budget. All chains share
+    gemini_llm and its connection: the budget is bound as a per-call generation_config override
+    (as in node_prewarm's ping), rather than configured into a new model instance.
+    """
+    return COACH_PROMPT | gemini_llm.bind(generation_config={"max_output_tokens": max_output_tokens})
+
 # --- LangGraph State Definition ---
 class PublicSpeakingState(TypedDict):
     video_gcs_uri: str # GCS URI of the original uploaded video
-    extracted_audio_gcs_uri: Optional[str] # GCS URI of the audio extracted from video
+    audio_chunks: Optional[list[Union[bytes, str]]] # Fixed-duration encoded audio chunks extracted from the video (GCS URI if staged)
+    transcript_parts: Annotated[list[tuple[int, str]], operator.add] # (chunk index, text) pairs, fanned in from transcribe_chunk
     transcript: Optional[str] # Text transcript of the speech
     feedback_text: Optional[str] # AI-generated textual feedback
-    feedback_audio_gcs_uri: Optional[str] # GCS URI of the synthesized audio feedback
+    feedback_audio_gcs_uri: Optional[str] # GCS URI of the synthesized audio feedback (None if not stored)
+    store_feedback_audio: Optional[bool] # Upload the synthesized audio to GCS (default True); callers playing the streamed audio can skip it
+
+class TranscribeChunkState(TypedDict):
+    chunk: Union[bytes, str] # A single encoded audio chunk, or its GCS URI if it was too large to send inline
+    index: int # Position of the chunk in the original audio
 
 # --- LangGraph Node Functions ---
+# Nodes return only the keys they update; LangGraph merges them into the shared state
+# (and concatenates `transcript_parts` through its reducer).
+
+async def node_prewarm(state: PublicSpeakingState) -> dict:
+    """
+    LangGraph Node: Warms up the Gemini, Speech-to-Text and Text-to-Speech connections
+    while node_extract_audio runs, so the later nodes do not pay for cold connection setup.
+    Only does work on the first run in a process. Failures are logged, never raised, and the whole
+    warm-up is cut off after PREWARM_TIMEOUT_SECONDS, since node_stream_coach_and_tts waits for it.
+    """
+    global _api_clients_warmed_up
+    if _api_clients_warmed_up:
+        return {}
+
+    async def ping_gemini():
+        await gemini_llm.ainvoke([HumanMessage(content="ping")], generation_config={"max_output_tokens": 1})
 
-def node_extract_audio(state: PublicSpeakingState) -> PublicSpeakingState:
+    print("Node: Warming up API connections...")
+    try:
+        results = await asyncio.wait_for(asyncio.gather(
+            warm_up_clients(),
+            get_tts_client().list_voices(language_code="en-US"),
+            ping_gemini(),
+            return_exceptions=True,
+        ), timeout=PREWARM_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        results = [TimeoutError(f"warm-up did not finish within {PREWARM_TIMEOUT_SECONDS}s")]
+    for result in results:
+        if isinstance(result, Exception):
+            print(f"Could not warm up API connection: {result}")
+    _api_clients_warmed_up = True
+    return {}
+
+async def node_extract_audio(state: PublicSpeakingState) -> dict:
     """
-    LangGraph Node: Extracts audio from the video stored in GCS,
-    saves it locally, then uploads the extracted audio back to GCS.
+    LangGraph Node: Extracts audio from the video stored in GCS as fixed-duration chunks.
+    ffmpeg writes each chunk to a temporary file that is read into memory and deleted right away
+    (see utils.stream_audio_chunks_from_gcs). Chunks are kept in memory so they can be sent to
+    Speech-to-Text inline; only chunks over the inline size limit are uploaded to GCS.
     """
     video_uri = state['video_gcs_uri']
     unique_id = uuid.uuid4().hex
-    local_video_path = f"/tmp/{unique_id}_input_video.mp4"
-    local_audio_path = f"/tmp/{unique_id}_extracted_audio.wav"
 
     print(f"Node: Extracting audio from {video_uri}...")
     try:
-        download_from_gcs(video_uri, local_video_path)
-        extracted_audio_path = extract_audio_from_video(local_video_path, local_audio_path)
+        chunks = await stream_audio_chunks_from_gcs(video_uri, AUDIO_CHUNK_SECONDS, AUDIO_CHUNK_FORMAT)
 
-        audio_gcs_uri = upload_to_gcs(extracted_audio_path, f"extracted_audio/{unique_id}.wav")
+        if not chunks:
+            raise ValueError(f"No audio found in video {video_uri}.")
 
-        os.remove(local_video_path)
-        os.remove(local_audio_path)
+        async def stage_if_too_large(index: int, chunk: bytes) -> Union[bytes, str]:
+            if len(chunk) <= INLINE_AUDIO_MAX_BYTES:
+                return chunk
+            return await asyncio.to_thread(
+                upload_bytes_to_gcs, chunk, f"chunks/{unique_id}/{index}", AUDIO_FORMATS[AUDIO_CHUNK_FORMAT]["content_type"]
+            )
 
-        return {**state, "extracted_audio_gcs_uri": audio_gcs_uri}
+        audio_chunks = await asyncio.gather(*(stage_if_too_large(i, chunk) for i, chunk in enumerate(chunks)))
+        return {"audio_chunks": list(audio_chunks)}
     except Exception as e:
         print(f"Error in node_extract_audio: {e}")
         raise
 
-def node_transcribe_audio(state: PublicSpeakingState) -> PublicSpeakingState:
+async def _long_running_recognize(config: speech.RecognitionConfig, audio: speech.RecognitionAudio, timeout: float = 300):
+    """
+    Runs a long-running Speech-to-Text recognize operation and returns its response.
+    The operation is polled with exponential backoff (0.5s, growing 1.5x up to 10s) through
+    asyncio.sleep, so long audios need few polls and waiting never blocks a thread.
     """
-    LangGraph Node: Transcribes audio from GCS using Google Cloud Speech-to-Text API.
+    operation = await get_speech_client().long_running_recognize(config=config, audio=audio)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    backoff = 0.5
+    while not await operation.done():
+        if loop.time() + backoff > deadline:
+            raise TimeoutError(f"Speech-to-Text operation {operation.operation.name} did not finish within {timeout}s.")
+        await asyncio.sleep(backoff)
+        backoff = min(backoff * 1.5, 10)
+    return await operation.result()
+
+async def node_transcribe_chunk(state: TranscribeChunkState) -> dict:
     """
-    audio_gcs_uri = state.get('extracted_audio_gcs_uri')
-    if not audio_gcs_uri:
-        raise ValueError("No extracted audio URI found in state for transcription.")
+    LangGraph Node: Transcribes a single audio chunk using Google Cloud Speech-to-Text API.
+    Runs once per chunk, in parallel, via the Send API.
+    """
+    chunk = state['chunk']
+    if isinstance(chunk, bytes):
+        audio = speech.RecognitionAudio(content=chunk)
+    else:
+        audio = speech.RecognitionAudio(uri=chunk)
 
-    audio = speech.RecognitionAudio(uri=audio_gcs_uri)
     config = speech.RecognitionConfig(
-        encoding=speech.RecognitionConfig.AudioEncoding.LINEAR16,
+        encoding=STT_ENCODINGS[AUDIO_CHUNK_FORMAT],
         sample_rate_hertz=16000,
         language_code="en-US",
-        enable_automatic_punctuation=True,
+        # No server-side punctuation or profanity passes: the transcript is only read by Gemini,
+        # which handles unpunctuated text (see COACH_SYSTEM_PROMPT)
+        enable_automatic_punctuation=False,
         model="video",
-        profanity_filter=True,
+        profanity_filter=False,
     )
 
-    print(f"Node: Transcribing audio from {audio_gcs_uri} using Speech-to-Text...")
-    operation = speech_client.long_running_recognize(config=config, audio=audio)
-    response = operation.result(timeout=300)
+    print(f"Node: Transcribing audio chunk {state['index']} using Speech-to-Text...")
+    if AUDIO_CHUNK_SECONDS <= SYNC_RECOGNIZE_MAX_SECONDS:
+        # Short chunks fit a single synchronous recognize RPC, with no operation to poll
+        response = await get_speech_client().recognize(config=config, audio=audio)
+    else:
+        response = await _long_running_recognize(config, audio)
 
-    transcript_parts = []
-    for result in response.results:
-        transcript_parts.append(result.alternatives[0].transcript)
+    text = " ".join(result.alternatives[0].transcript for result in response.results)
 
-    full_transcript = " ".join(transcript_parts)
-    print(f"Transcription complete. Length: {len(full_transcript)} characters.")
+    return {"transcript_parts": [(state['index'], text)]}
 
-    return {**state, "transcript": full_transcript}
-
-def node_coach_feedback(state: PublicSpeakingState) -> PublicSpeakingState:
-    """
-    LangGraph Node: Uses Google Gemini (via LangChain) to generate public speaking feedback.
+async def node_merge_transcript(state: PublicSpeakingState) -> dict:
     """
-    transcript = state.get('transcript')
-    if not transcript:
-        raise ValueError("No transcript available for coaching feedback generation.")
-
-    prompt = f"""
-    You are an expert public speaking coach. Your goal is to provide constructive, actionable, and encouraging feedback on the following public speaking transcript.
-    The feedback should be suitable for audio delivery, so keep sentences clear and concise.
-
-    Focus on these three main sections:
-    1.  **Strengths:** Identify 2-3 specific positive aspects of the speaker's delivery based on the transcript. Examples: "Your opening was engaging," "You used clear and concise language," "Your points flowed logically."
-    2.  **Areas for Improvement:** Identify 2-3 specific, actionable suggestions for improvement. Examples: "Consider reducing filler words like 'um' or 'uh'," "Try varying your vocal pace to emphasize key points," "Ensure your conclusion clearly summarizes your main message."
-    3.  **Overall Encouragement:** End with a brief, positive, and motivating statement.
-
-    The transcript of the speech is enclosed in triple backticks:
-    ```
-    {transcript}
-    ```
-    Please provide your feedback in a natural, conversational, and supportive tone.
+    LangGraph Node: Joins the per-chunk transcripts back together in playback order.
     """
-    print("Node: Generating coaching feedback with Gemini...")
-    messages = [HumanMessage(content=prompt)]
-    response = gemini_llm.invoke(messages)
-    feedback_text = response.content
-    print("Gemini feedback text generated.")
+    transcript_parts = sorted(state.get('transcript_parts') or [])
+    full_transcript = " ".join(text for _, text in transcript_parts if text)
+    print(f"Transcription complete. Length: {len(full_transcript)} characters.")
 
-    return {**state, "feedback_text": feedback_text}
+    return {"transcript": full_transcript}
 
-def node_synthesize_audio_feedback(state: PublicSpeakingState) -> PublicSpeakingState:
+async def _synthesize_speech(text: str) -> bytes:
     """
-    LangGraph Node: Converts the textual feedback into natural-sounding audio
-    using Google Cloud Text-to-Speech API and uploads it to GCS.
-    Removes markdown bold formatting (**) before synthesis.
+    Converts a piece of feedback text into MP3 audio using Google Cloud Text-to-Speech API.
     """
-    feedback_text = state.get('feedback_text')
-    if not feedback_text:
-        raise ValueError("No feedback text found in state for audio synthesis.")
-
-    # FIX: Remove markdown bold (**) before sending to Text-to-Speech
-    # This ensures the asterisks are not read aloud.
-    clean_feedback_text = re.sub(r'\*\*', '', feedback_text)
-
-    synthesis_input = texttospeech.SynthesisInput(text=clean_feedback_text)
+    synthesis_input = texttospeech.SynthesisInput(text=text)
 
     voice = texttospeech.VoiceSelectionParams(
         language_code="en-US",
@@ -163,23 +284,192 @@ def node_synthesize_audio_feedback(state: PublicSpeakingState) -> PublicSpeaking
         pitch=0.0,
     )
 
-    print("Node: Synthesizing audio feedback using Text-to-Speech...")
-    response = tts_client.synthesize_speech(
+    response = await get_tts_client().synthesize_speech(
         input=synthesis_input, voice=voice, audio_config=audio_config
     )
+    return response.audio_content
 
-    unique_id = uuid.uuid4().hex
-    local_feedback_audio_path = f"/tmp/{unique_id}_feedback.mp3"
-    with open(local_feedback_audio_path, "wb") as out:
-        out.write(response.audio_content)
-    print(f"Audio content saved locally to '{local_feedback_audio_path}'")
+def _feedback_cache_key(transcript: str) -> str:
+    """
+    Hashes a transcript into a feedback cache key. Whitespace is normalized so re-runs of the same
+    speech match; the model, prompt and output budget limits are hashed in too, so changing any of
+    them invalidates old entries.
+    """
+    normalized_transcript = " ".join(transcript.split())
+    key_material = "\n".join([
+        GEMINI_MODEL_NAME, COACH_SYSTEM_PROMPT, COACH_HUMAN_PROMPT,
+        str(FEEDBACK_MIN_OUTPUT_TOKENS), str(FEEDBACK_MAX_OUTPUT_TOKENS), normalized_transcript,
+    ])
+    return hashlib.blake2b(key_material.encode(), digest_size=16).hexdigest()
+
+def _feedback_token_budget(transcript: str) -> int:
+    """
+    Returns the Gemini output token budget for coaching a transcript: about one token per six
+    transcript characters, clamped to [FEEDBACK_MIN_OUTPUT_TOKENS, FEEDBACK_MAX_OUTPUT_TOKENS].
+    Short speeches need short feedback, so they get a smaller decode budget; the floor still
+    leaves room for every section COACH_SYSTEM_PROMPT asks for.
+    """
+    return max(FEEDBACK_MIN_OUTPUT_TOKENS, min(FEEDBACK_MAX_OUTPUT_TOKENS, len(transcript) // 6))
+
+async def coached(transcript: str) -> AsyncIterator[str]:
+    """
+    Streams coaching feedback for a transcript from Gemini, with the complete responses cached in GCS
+    (under FEEDBACK_CACHE_PREFIX) by transcript hash. On a cache hit the stored feedback is yielded
+    in one piece and Gemini is not called. Only complete responses (finish reason STOP, non-empty)
+    are cached; entries expire after FEEDBACK_CACHE_TTL. Cache errors are logged and treated as a miss.
+    """
+    cache_blob_name = f"{FEEDBACK_CACHE_PREFIX}/{_feedback_cache_key(transcript)}.txt"
+    try:
+        cached_feedback = await asyncio.to_thread(read_text_from_gcs, cache_blob_name, FEEDBACK_CACHE_TTL)
+    except Exception as e:
+        print(f"Could not read feedback cache '{cache_blob_name}': {e}")
+        cached_feedback = None
+    if cached_feedback and cached_feedback.strip():
+        print("Coaching feedback served from cache.")
+        yield cached_feedback
+        return
+
+    # Ask for about one word per two budget tokens, well inside the budget
+    token_budget = _feedback_token_budget(transcript)
+    feedback_parts = []
+    finish_reason = None
+    async for chunk in get_coach_chain(token_budget).astream({"transcript": transcript, "word_limit": token_budget // 2}):
+        feedback_parts.append(chunk.content)
+        finish_reason = chunk.response_metadata.get("finish_reason") or finish_reason
+        yield chunk.content
+
+    # Truncated (MAX_TOKENS), blocked (SAFETY, RECITATION, ...) or empty responses are not cached
+    feedback_text = "".join(feedback_parts)
+    if finish_reason != "STOP" or not feedback_text.strip():
+        print(f"Coaching feedback ended with finish reason {finish_reason}; not caching it.")
+        return
+    try:
+        await asyncio.to_thread(write_text_to_gcs, feedback_text, cache_blob_name)
+    except Exception as e:
+        print(f"Could not write feedback cache '{cache_blob_name}': {e}")
 
-    feedback_audio_gcs_uri = upload_to_gcs(local_feedback_audio_path, f"feedback_audio/{unique_id}.mp3")
-    os.remove(local_feedback_audio_path)
+def _split_tts_segments(text: str) -> tuple[list[str], str]:
+    """
+    Splits text into Text-to-Speech segments of whole sentences, each at least TTS_MIN_SEGMENT_CHARS
+    long. Returns the segments and the remaining text, which does not yet make a full segment.
+    """
+    segments = []
+    start = 0
+    for match in SENTENCE_END_PATTERN.finditer(text):
+        if match.end() - start >= TTS_MIN_SEGMENT_CHARS:
+            segments.append(text[start:match.end()])
+            start = match.end()
+    return segments, text[start:]
+
+async def node_stream_coach_and_tts(state: PublicSpeakingState) -> dict:
+    """
+    LangGraph Node: Streams public speaking feedback from Google Gemini (via LangChain, or from the
+    feedback cache) and converts it into audio a few sentences at a time using Google Cloud Text-to-Speech API,
+    so synthesis starts as soon as the first sentences arrive instead of after the full response.
+    Segments are synthesized concurrently while Gemini keeps streaming; the MP3 segments are
+    concatenated in order and uploaded to GCS, unless the state sets store_feedback_audio to False.
+    Removes markdown bold formatting (**) before synthesis.
 
-    return {**state, "feedback_audio_gcs_uri": feedback_audio_gcs_uri}
+    Each synthesized segment is also emitted, in order, as a custom stream event
+    ({"feedback_text": ..., "feedback_audio": ...}) for graph.astream(stream_mode="custom").
+    """
+    transcript = state.get('transcript')
+    if not transcript:
+        raise ValueError("No transcript available for coaching feedback generation.")
+
+    try:
+        writer = get_stream_writer()
+    except RuntimeError:
+        writer = lambda event: None # Called outside of a graph run (e.g. the standalone node test below)
+
+    feedback_parts = []
+    feedback_audio = io.BytesIO()
+    segments: asyncio.Queue = asyncio.Queue() # (text, synthesis task or None), in playback order; None ends the stream
+    syntheses = []
+
+    def enqueue_segment(text: str):
+        # FIX: Remove markdown bold (**) before sending to Text-to-Speech
+        # This ensures the asterisks are not read aloud.
+        clean_text = text.replace('**', '').strip()
+        synthesis = asyncio.create_task(_synthesize_speech(clean_text)) if clean_text else None
+        if synthesis:
+            syntheses.append(synthesis)
+        segments.put_nowait((text, synthesis))
+
+    async def emit_segments():
+        while (segment := await segments.get()) is not None:
+            text, synthesis = segment
+            audio_content = await synthesis if synthesis else b""
+            # MP3 frames are self-contained, so the segments can simply be appended
+            feedback_audio.write(audio_content)
+            writer({"feedback_text": text, "feedback_audio": audio_content})
+
+    print("Node: Streaming coaching feedback from Gemini into Text-to-Speech...")
+    emitter = asyncio.create_task(emit_segments())
+    try:
+        buffer = ""
+        async for text in coached(transcript):
+            feedback_parts.append(text)
+            # Synthesize every complete segment; keep the rest buffered
+            ready_segments, buffer = _split_tts_segments(buffer + text)
+            for segment in ready_segments:
+                enqueue_segment(segment)
+        enqueue_segment(buffer)
+        segments.put_nowait(None)
+        await emitter
+    finally:
+        # On failure, stop the emitter and any synthesis still in flight
+        emitter.cancel()
+        for synthesis in syntheses:
+            synthesis.cancel()
+
+    feedback_text = "".join(feedback_parts)
+    print("Gemini feedback text generated and synthesized.")
+
+    feedback_audio_gcs_uri = None
+    if state.get('store_feedback_audio', True):
+        feedback_audio_gcs_uri = await asyncio.to_thread(
+            upload_bytes_to_gcs, feedback_audio.getvalue(), f"feedback_audio/{uuid.uuid4().hex}.mp3"
+        )
+
+    return {"feedback_text": feedback_text, "feedback_audio_gcs_uri": feedback_audio_gcs_uri}
 
 # Example usage (for testing individual nodes, not typical LangGraph flow)
+async def _test_individual_nodes(initial_dummy_state: PublicSpeakingState):
+    # Nodes return partial updates, so merge each one into the running state
+    state = dict(initial_dummy_state)
+
+    # Test node_extract_audio
+    print("\nTesting node_extract_audio...")
+    state.update(await node_extract_audio(state))
+    print(f"Audio chunks: {len(state['audio_chunks'])}")
+
+    # Test node_transcribe_chunk (one call per chunk, run concurrently like the graph does)
+    print("\nTesting node_transcribe_chunk...")
+    chunk_updates = await asyncio.gather(*(
+        node_transcribe_chunk({"chunk": chunk, "index": i})
+        for i, chunk in enumerate(state['audio_chunks'])
+    ))
+    state['transcript_parts'] = [part for update in chunk_updates for part in update['transcript_parts']]
+
+    # Test node_merge_transcript
+    print("\nTesting node_merge_transcript...")
+    state.update(await node_merge_transcript(state))
+    print(f"Transcript: {state['transcript'][:200]}...")
+
+    # Test node_stream_coach_and_tts
+    print("\nTesting node_stream_coach_and_tts...")
+    state.update(await node_stream_coach_and_tts(state))
+    print(f"Feedback Text: {state['feedback_text'][:200]}...")
+    print(f"Feedback Audio URI: {state['feedback_audio_gcs_uri']}")
+
+    # Clean up GCS objects created during this test
+    # from utils import delete_gcs_blob
+    # for chunk in state['audio_chunks']:
+    #     if isinstance(chunk, str):
+    #         delete_gcs_blob(chunk)
+    # delete_gcs_blob(state['feedback_audio_gcs_uri'])
+
 if __name__ == "__main__":
     print("--- Testing agent_nodes.py functions (individual calls) ---")
     # This requires you to have a video file uploaded to GCS and its URI.
@@ -198,31 +488,9 @@ if __name__ == "__main__":
     else:
         initial_dummy_state = PublicSpeakingState(video_gcs_uri=dummy_video_uri)
         try:
-            # Test node_extract_audio
-            print("\nTesting node_extract_audio...")
-            state_after_extract = node_extract_audio(initial_dummy_state.copy())
-            print(f"Extracted audio URI: {state_after_extract['extracted_audio_gcs_uri']}")
-
-            # Test node_transcribe_audio
-            print("\nTesting node_transcribe_audio...")
-            state_after_transcribe = node_transcribe_audio(state_after_extract.copy())
-            print(f"Transcript: {state_after_transcribe['transcript'][:200]}...")
-
-            # Test node_coach_feedback
-            print("\nTesting node_coach_feedback...")
-            state_after_coach = node_coach_feedback(state_after_transcribe.copy())
-            print(f"Feedback Text: {state_after_coach['feedback_text'][:200]}...")
-
-            # Test node_synthesize_audio_feedback
-            print("\nTesting node_synthesize_audio_feedback...")
-            state_after_synthesize = node_synthesize_audio_feedback(state_after_coach.copy())
-            print(f"Feedback Audio URI: {state_after_synthesize['feedback_audio_gcs_uri']}")
-
-            # Clean up GCS objects created during this test
-            # from utils import delete_gcs_blob
-            # delete_gcs_blob(state_after_extract['extracted_audio_gcs_uri'])
-            # delete_gcs_blob(state_after_synthesize['feedback_audio_gcs_uri'])
-
+            # All nodes are coroutines; run them on one event loop so the async
+            # Speech/TTS clients stay bound to the loop that created them.
+            asyncio.run(_test_individual_nodes(initial_dummy_state))
         except Exception as e:
             print(f"\nError during individual node testing: {e}")
             print("Please ensure you have valid Google Cloud credentials, project ID, bucket, and a sample video in your GCS bucket.")
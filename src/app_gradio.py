@@ -1,4 +1,5 @@
 # app_gradio.py
+import asyncio
 import gradio as gr
 import os
 import uuid
@@ -7,15 +8,15 @@ import tempfile
 import re # Import regular expression module for cleaning text
 
 # Import helper functions and the LangGraph application builder
-from utils import upload_to_gcs, download_from_gcs, delete_gcs_blob, GCS_BUCKET_NAME
+from utils import upload_to_gcs, delete_gcs_blob, GCS_BUCKET_NAME
 from agent_graph import build_public_speaking_coach_graph
-from agent_nodes import PublicSpeakingState # Import the state class for type hinting
+from agent_nodes import PublicSpeakingState, warm_up_clients # State class for type hinting, gRPC warm-up
 
 # Initialize the LangGraph application once when the Gradio app starts
 public_speaking_coach_app = build_public_speaking_coach_graph()
 
 # --- Gradio Interface Function ---
-async def get_speech_feedback(video_file_path: str) -> tuple[str, Optional[str], gr.HTML, gr.Button, gr.Markdown]:
+async def get_speech_feedback(video_file_path: str) -> tuple[str, Optional[bytes], gr.HTML, gr.Button, gr.Markdown]:
     """
     Gradio function to handle video upload/recording, trigger the AI coach workflow,
     and return textual and audio feedback, along with updates for UI components.
@@ -25,10 +26,10 @@ async def get_speech_feedback(video_file_path: str) -> tuple[str, Optional[str],
                                 provided by Gradio.
 
     Returns:
-        tuple[str, Optional[str], gr.HTML, gr.Button, gr.Markdown]: A tuple containing:
+        tuple[str, Optional[bytes], gr.HTML, gr.Button, gr.Markdown]: A tuple containing:
             - The textual feedback from the AI coach.
-            - The local path to the synthesized audio feedback file (for Gradio playback),
-              or None if audio synthesis failed.
+            - The next MP3 segment of the synthesized audio feedback, appended to the streaming
+              audio player as soon as it is synthesized, or None if there is no new audio.
             - Update for loading_indicator (hide).
             - Update for submit_button (enable).
             - Update for audio_placeholder (hide).
@@ -57,14 +58,10 @@ async def get_speech_feedback(video_file_path: str) -> tuple[str, Optional[str],
     # Generate a unique ID for this session to manage files
     session_id = uuid.uuid4().hex
     gcs_video_blob_name = f"user_uploads/{session_id}_input_video.mp4"
-    
-    # Use tempfile.gettempdir() to ensure the audio file is saved in Gradio's expected temp directory
-    local_feedback_audio_path = os.path.join(tempfile.gettempdir(), f"{session_id}_final_feedback.mp3")
 
     # Initialize GCS URIs for cleanup in finally block
     video_gcs_uri = None
-    extracted_audio_gcs_uri = None
-    feedback_audio_gcs_uri = None
+    staged_chunk_gcs_uris = []
 
     try:
         # Update UI to show loading and disable button
@@ -75,44 +72,51 @@ async def get_speech_feedback(video_file_path: str) -> tuple[str, Optional[str],
 
         # 1. Upload the user's video to Google Cloud Storage
         print(f"Uploading video '{video_file_path}' to GCS...")
-        video_gcs_uri = upload_to_gcs(video_file_path, gcs_video_blob_name)
+        video_gcs_uri = await asyncio.to_thread(upload_to_gcs, video_file_path, gcs_video_blob_name)
         print(f"Video uploaded to GCS: {video_gcs_uri}")
 
         # 2. Prepare the initial state for the LangGraph agent
-        initial_state = PublicSpeakingState(video_gcs_uri=video_gcs_uri)
+        # The audio feedback is streamed straight to the player, so the graph does not need to store it in GCS
+        initial_state = PublicSpeakingState(video_gcs_uri=video_gcs_uri, store_feedback_audio=False)
 
         # 3. Run the LangGraph agent workflow
         print(f"Starting LangGraph agent for session: {session_id}")
         
-        # Correctly extract the final state from the LangGraph stream
+        # "values" events carry the full state after each step (the last one is the final state);
+        # "custom" events carry each feedback segment and its audio as soon as it has been synthesized,
+        # so the audio player starts playing while the rest of the feedback is still being generated
         final_state_output = None
-        for s in public_speaking_coach_app.stream(initial_state):
-            if 'synthesize_audio_feedback' in s:
-                final_state_output = s['synthesize_audio_feedback']
-
-        if not final_state_output:
-            raise gr.Error("LangGraph agent did not produce a final state containing audio feedback.")
+        streamed_feedback_text = ""
+        streamed_audio_bytes = 0
+        async for mode, s in public_speaking_coach_app.astream(initial_state, stream_mode=["values", "custom"]):
+            if mode == "custom":
+                streamed_feedback_text += s["feedback_text"]
+                streamed_audio_bytes += len(s["feedback_audio"])
+                yield streamed_feedback_text, s["feedback_audio"] or None, \
+                      gr.HTML(initial_loading_state_html, visible=True), \
+                      gr.Button("Processing...", variant="primary", elem_classes="mt-5", interactive=False), \
+                      gr.Markdown(initial_audio_placeholder_html, visible=False)
+                continue
+            final_state_output = s
+            # Audio chunks are normally passed inline; collect any staged in GCS for cleanup, even if a later node fails
+            staged_chunk_gcs_uris = [chunk for chunk in s.get('audio_chunks') or [] if isinstance(chunk, str)]
+
+        if not final_state_output or not final_state_output.get('feedback_text'):
+            raise gr.Error("LangGraph agent did not produce a final state containing feedback.")
 
         # 4. Extract feedback from the final state of the graph
         feedback_text = final_state_output.get('feedback_text', 'No textual feedback generated by the AI coach.')
-        feedback_audio_gcs_uri = final_state_output.get('feedback_audio_gcs_uri')
-        extracted_audio_gcs_uri = final_state_output.get('extracted_audio_gcs_uri') # For cleanup
 
-        # DEBUGGING: Print the extracted audio URI value
-        print(f"DEBUG: Extracted feedback_audio_gcs_uri: {feedback_audio_gcs_uri}")
+        # DEBUGGING: Print how much audio was streamed to the player
+        print(f"DEBUG: Streamed {streamed_audio_bytes} bytes of audio feedback")
 
-        if not feedback_audio_gcs_uri:
+        if not streamed_audio_bytes:
             raise gr.Error("Failed to generate audio feedback from Text-to-Speech.")
 
-        # 5. Download the synthesized audio feedback from GCS for Gradio to play
-        print(f"Downloading audio feedback from GCS: {feedback_audio_gcs_uri}")
-        download_from_gcs(feedback_audio_gcs_uri, local_feedback_audio_path)
-        print(f"Audio feedback downloaded to: {local_feedback_audio_path}")
-
         print(f"Session {session_id} complete. Returning feedback.")
         
-        # Return all 5 outputs for the components
-        yield feedback_text, local_feedback_audio_path, \
+        # Return all 5 outputs for the components; the audio has already been streamed to the player
+        yield feedback_text, None, \
               gr.HTML(initial_loading_state_html, visible=False), \
               gr.Button(initial_button_label, variant="primary", elem_classes="mt-5", interactive=True), \
               gr.Markdown(initial_audio_placeholder_html, visible=False)
@@ -135,24 +139,14 @@ async def get_speech_feedback(video_file_path: str) -> tuple[str, Optional[str],
 
         # Delete original uploaded video from GCS
         if video_gcs_uri:
-            delete_gcs_blob(video_gcs_uri)
-        # Delete extracted audio from GCS
-        if extracted_audio_gcs_uri:
-            delete_gcs_blob(extracted_audio_gcs_uri)
-        # Delete synthesized audio feedback from GCS
-        if feedback_audio_gcs_uri:
-            delete_gcs_blob(feedback_audio_gcs_uri)
+            await asyncio.to_thread(delete_gcs_blob, video_gcs_uri)
+        # Delete extracted audio chunks that were staged in GCS
+        await asyncio.gather(*(asyncio.to_thread(delete_gcs_blob, chunk_uri) for chunk_uri in staged_chunk_gcs_uris))
 
         # Delete local temporary files created by Gradio and during processing
         if os.path.exists(video_file_path):
             os.remove(video_file_path)
             print(f"Cleaned up local video file: {video_file_path}")
-        # IMPORTANT: Do NOT remove local_feedback_audio_path here if Gradio needs it for playback
-        # Gradio will manage cleanup of files it's responsible for.
-        # If the file is still there after the app closes, it's fine for debugging.
-        # if os.path.exists(local_feedback_audio_path):
-        #     os.remove(local_feedback_audio_path)
-        #     print(f"Cleaned up local audio file: {local_feedback_audio_path}")
 
 # --- Custom CSS for Gradio UI improvements ---
 custom_css = """
@@ -363,7 +357,8 @@ with gr.Blocks(css=custom_css, theme=gr.themes.Soft()) as demo: # Using Soft the
             label="Audio Feedback from AI Coach",
             interactive=False,
             autoplay=True,
-            type="filepath",
+            streaming=True, # Feedback segments are played as they are synthesized
+            format="mp3",
             elem_classes="rounded-md shadow-sm"
         )
         audio_placeholder = gr.Markdown("<p id='audioPlaceholder' class='text-gray-500 text-sm italic mt-2'>Audio feedback will appear here once generated.</p>")
@@ -401,6 +396,10 @@ with gr.Blocks(css=custom_css, theme=gr.themes.Soft()) as demo: # Using Soft the
     )
 
 
+    # Open the Speech-to-Text/Text-to-Speech gRPC channels on Gradio's event loop before the first request
+    # (the async clients are bound to the loop they are created on, so this cannot run at import time)
+    demo.load(fn=warm_up_clients, queue=False)
+
     # JS for managing loading state and initial placeholder text
     demo.load(js="""
         () => {
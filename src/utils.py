@@ -1,20 +1,63 @@
 # utils.py
+import asyncio
+import mimetypes
 import os
-import uuid
+import subprocess
+import tempfile
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+import google.auth.credentials
+import google.auth.exceptions
+import google.auth.transport.requests
+import google_crc32c
+from google.api_core.exceptions import NotFound
 from google.cloud import storage
-from pydub import AudioSegment
-from pydub.utils import mediainfo
+from requests.adapters import HTTPAdapter
 
 # --- Configuration ---
 # IMPORTANT: Replace with your actual GCS bucket name
 # This bucket will store uploaded videos, extracted audio, and generated feedback audio.
 GCS_BUCKET_NAME = "your-public-speaking-coach-bucket" # <<< IMPORTANT: Replace with your GCS bucket name
+AUDIO_SAMPLE_RATE = 16000 # Sample rate (Hz) of the extracted audio, as expected by Speech-to-Text
+
+# Audio formats the extracted audio can be encoded in: ffmpeg codec arguments, ffmpeg muxer
+# and MIME type. Speech-to-Text reads all three natively. Opus at 24 kbps is 10-40x smaller than
+# 16-bit PCM at 256 kbps, which makes it the cheapest format to move between GCS, this process and the API.
+AUDIO_FORMATS = {
+    "wav": {"ffmpeg_args": ["-acodec", "pcm_s16le"], "muxer": "wav", "content_type": "audio/wav"},
+    "flac": {"ffmpeg_args": ["-acodec", "flac"], "muxer": "flac", "content_type": "audio/flac"},
+    "ogg_opus": {"ffmpeg_args": ["-acodec", "libopus", "-b:a", "24k"], "muxer": "ogg", "content_type": "audio/ogg"},
+}
+
+# Formats stream_audio_chunks_from_gcs can cut into chunks. The segment muxer runs a single FLAC
+# encoder across all chunks, so FLAC chunks carry continued frame numbers and a STREAMINFO
+# header without their sample count (or with the whole stream's, for the last chunk).
+SEGMENTED_AUDIO_FORMATS = ("wav", "ogg_opus")
+
+# GCS upload/download checksums are computed with google-crc32c; its pure-Python fallback
+# is orders of magnitude slower than the C extension (which uses SSE4.2 CRC32 instructions).
+if google_crc32c.implementation != "c":
+    print("WARNING: google-crc32c C extension is not available; GCS checksums will be computed in pure Python.")
 
 # Initialize Google Cloud Storage client
 # This client will automatically use Application Default Credentials (ADC)
 # if you've run `gcloud auth application-default login` locally,
 # or a service account if deployed on GCP services like Cloud Run.
 storage_client = storage.Client()
+# Chunk uploads run in parallel worker threads; requests' default pool (10 connections) would
+# discard the extra connections and pay a fresh TLS handshake for them on every upload.
+storage_client._http.mount("https://", HTTPAdapter(pool_connections=32, pool_maxsize=32))
+
+def warm_up_gcs():
+    """
+    Fetches the OAuth access token and opens a pooled HTTPS connection to GCS,
+    so the first request does not pay for the auth and TLS handshakes.
+    """
+    try:
+        next(iter(storage_client.list_blobs(GCS_BUCKET_NAME, max_results=1)), None)
+        print("GCS client warmed up.")
+    except Exception as e:
+        print(f"Could not warm up GCS client: {e}")
 
 def upload_to_gcs(local_file_path: str, destination_blob_name: str) -> str:
     """
@@ -29,10 +72,35 @@ def upload_to_gcs(local_file_path: str, destination_blob_name: str) -> str:
     """
     bucket = storage_client.bucket(GCS_BUCKET_NAME)
     blob = bucket.blob(destination_blob_name)
-    blob.upload_from_filename(local_file_path)
+    # Passing the size up front lets the client pick a single multipart request for small files;
+    # the CRC32C integrity check uses the native google-crc32c extension (verified at import).
+    # upload_from_file cannot see the file name, so the content type is guessed from it here.
+    with open(local_file_path, "rb") as f:
+        blob.upload_from_file(
+            f, size=os.path.getsize(local_file_path), checksum="crc32c",
+            content_type=mimetypes.guess_type(local_file_path)[0],
+        )
     print(f"File '{local_file_path}' uploaded to 'gs://{GCS_BUCKET_NAME}/{destination_blob_name}'")
     return f"gs://{GCS_BUCKET_NAME}/{destination_blob_name}"
 
+def upload_bytes_to_gcs(data: bytes, destination_blob_name: str, content_type: str = "audio/mpeg") -> str:
+    """
+    Uploads in-memory data to a Google Cloud Storage bucket, without going through a local file.
+
+    Args:
+        data (bytes): The content to upload.
+        destination_blob_name (str): The desired path/name for the file in GCS.
+        content_type (str): The MIME type to store the object with.
+
+    Returns:
+        str: The GCS URI (gs://bucket-name/blob-name) of the uploaded object.
+    """
+    bucket = storage_client.bucket(GCS_BUCKET_NAME)
+    blob = bucket.blob(destination_blob_name)
+    blob.upload_from_string(data, content_type=content_type)
+    print(f"{len(data)} bytes uploaded to 'gs://{GCS_BUCKET_NAME}/{destination_blob_name}'")
+    return f"gs://{GCS_BUCKET_NAME}/{destination_blob_name}"
+
 def download_from_gcs(gcs_uri: str, local_file_path: str):
     """
     Downloads a file from a Google Cloud Storage bucket to a local path.
@@ -51,28 +119,192 @@ def download_from_gcs(gcs_uri: str, local_file_path: str):
     blob.download_to_filename(local_file_path)
     print(f"File '{gcs_uri}' downloaded to '{local_file_path}'")
 
-def extract_audio_from_video(video_path: str, output_audio_path: str) -> str:
+def extract_audio_from_video(video_path: str, output_audio_path: str, audio_format: str = "wav") -> str:
     """
-    Extracts audio from a video file, resamples it to 16kHz, and saves it as a WAV file.
+    Extracts audio from a video file, resamples it to 16kHz mono, and saves it in one of
+    AUDIO_FORMATS (a WAV file by default).
+    A single ffmpeg invocation does the decode, resample and encode, so the waveform never
+    has to be loaded into Python.
     Requires `ffmpeg` to be installed and accessible in your system's PATH.
     """
     try:
-        audio = AudioSegment.from_file(video_path)
-        
-        # --- FIX: Explicitly resample audio to 16kHz for Speech-to-Text compatibility ---
-        if audio.frame_rate != 16000:
-            print(f"Resampling audio from {audio.frame_rate}Hz to 16000Hz for Speech-to-Text compatibility...")
-            audio = audio.set_frame_rate(16000)
-        # --- END FIX ---
-
-        audio.export(output_audio_path, format="wav")
+        subprocess.run(
+            ["ffmpeg", "-y", "-i", video_path, "-vn",
+             "-ac", "1", "-ar", str(AUDIO_SAMPLE_RATE),
+             *AUDIO_FORMATS[audio_format]["ffmpeg_args"], "-f", AUDIO_FORMATS[audio_format]["muxer"],
+             output_audio_path],
+            check=True,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+        )
         print(f"Audio extracted and resampled from '{video_path}' to '{output_audio_path}'")
         return output_audio_path
+    except subprocess.CalledProcessError as e:
+        print(f"Error extracting or resampling audio from video '{video_path}': {e.stderr.decode().strip()}")
+        raise
     except Exception as e:
         print(f"Error extracting or resampling audio from video '{video_path}': {e}")
         print("Please ensure FFmpeg is installed and in your system's PATH.")
         raise
 
+_gcs_url_signing_available = True # Cleared after the first failed attempt to sign a URL in this process
+
+def _gcs_signed_url(gcs_uri: str, expiration: timedelta = timedelta(minutes=15)) -> Optional[str]:
+    """
+    Returns a short-lived V4 signed URL that only allows reading one GCS object, for tools that
+    read over HTTP (e.g. ffmpeg). Unlike an OAuth access token, the URL is safe to put on a
+    command line: it grants nothing beyond this object and expires on its own.
+
+    Returns None if the credentials cannot sign URLs: user credentials from
+    `gcloud auth application-default login` have no service account, and an attached service
+    account needs `roles/iam.serviceAccountTokenCreator` on itself to sign through IAM.
+    """
+    global _gcs_url_signing_available
+    if not _gcs_url_signing_available:
+        return None
+
+    path_parts = gcs_uri.replace("gs://", "").split("/", 1)
+    bucket_name = path_parts[0]
+    blob_name = path_parts[1] if len(path_parts) > 1 else ""
+    blob = storage_client.bucket(bucket_name).blob(blob_name)
+
+    credentials = storage_client._credentials
+    try:
+        if isinstance(credentials, google.auth.credentials.Signing):
+            # Service account key: signed locally with its private key
+            return blob.generate_signed_url(version="v4", expiration=expiration, method="GET")
+        if not hasattr(credentials, "service_account_email"):
+            raise google.auth.exceptions.GoogleAuthError(
+                f"{type(credentials).__name__} credentials are not a service account and cannot sign URLs"
+            )
+        # Credentials without a private key (e.g. Cloud Run's metadata server) are signed through the IAM signBlob API
+        if not credentials.valid:
+            credentials.refresh(google.auth.transport.requests.Request())
+        return blob.generate_signed_url(
+            version="v4", expiration=expiration, method="GET",
+            service_account_email=credentials.service_account_email, access_token=credentials.token,
+        )
+    except google.auth.exceptions.GoogleAuthError as e:
+        print(f"Could not sign GCS URLs ({e}); videos will be downloaded before audio extraction. "
+              "Grant the service account roles/iam.serviceAccountTokenCreator on itself to stream them instead.")
+        _gcs_url_signing_available = False
+        return None
+
+def _pop_chunk_file(chunk_path: str) -> bytes:
+    """Reads a chunk file written by ffmpeg's segment muxer and deletes it."""
+    with open(chunk_path, "rb") as f:
+        chunk = f.read()
+    os.remove(chunk_path)
+    return chunk
+
+async def stream_audio_chunks_from_gcs(video_uri: str, chunk_seconds: int = 55, audio_format: str = "ogg_opus") -> list[bytes]:
+    """
+    Extracts 16kHz mono audio from a video stored in GCS as fixed-duration encoded chunks,
+    without downloading the video to local disk when the credentials can sign URLs.
+
+    A single ffmpeg process reads the video straight from GCS over HTTPS, through a short-lived
+    signed URL (it uses range requests, so MP4 files with their index at the end still work),
+    or from a local copy if the credentials cannot sign URLs (see _gcs_signed_url). It resamples and encodes the audio, and cuts it into chunks with its segment muxer. Each chunk
+    is a complete, independently decodable file. ffmpeg names each chunk file on stdout as soon
+    as it is complete; the file is then read into memory and deleted, so only about one chunk
+    is on local disk at a time.
+    Requires `ffmpeg` to be installed and accessible in your system's PATH.
+
+    Args:
+        video_uri (str): The GCS URI (gs://bucket-name/blob-name) of the video.
+        chunk_seconds (int): The nominal duration of each chunk in seconds. The segment muxer cuts
+            on packet boundaries and adds codec delay, so full chunks run a few tens of
+            milliseconds longer; the last chunk may be shorter.
+        audio_format (str): The format to encode the chunks in (one of SEGMENTED_AUDIO_FORMATS).
+
+    Returns:
+        list[bytes]: The encoded chunks, in playback order.
+    """
+    if audio_format not in SEGMENTED_AUDIO_FORMATS:
+        raise ValueError(f"Audio format '{audio_format}' cannot be chunked; use one of {SEGMENTED_AUDIO_FORMATS}.")
+
+    video_url = await asyncio.to_thread(_gcs_signed_url, video_uri)
+    audio_format_spec = AUDIO_FORMATS[audio_format]
+    with tempfile.TemporaryDirectory(prefix="audio_chunks_") as chunk_dir:
+        video_input = video_url
+        if video_input is None:
+            video_input = os.path.join(chunk_dir, "input_video")
+            await asyncio.to_thread(download_from_gcs, video_uri, video_input)
+
+        proc = await asyncio.create_subprocess_exec(
+            "ffmpeg", "-nostdin", "-loglevel", "error",
+            "-i", video_input,
+            "-vn", "-ac", "1", "-ar", str(AUDIO_SAMPLE_RATE), *audio_format_spec["ffmpeg_args"],
+            "-f", "segment", "-segment_time", str(chunk_seconds), "-reset_timestamps", "1",
+            "-segment_format", audio_format_spec["muxer"],
+            "-segment_list", "pipe:1", "-segment_list_type", "flat",
+            os.path.join(chunk_dir, f"%05d.{audio_format_spec['muxer']}"),
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        stderr_task = asyncio.create_task(proc.stderr.read())
+        try:
+            # The segment list gets one line per chunk file, written when ffmpeg closes that file
+            chunks = []
+            async for line in proc.stdout:
+                chunk_name = os.path.basename(line.decode().strip())
+                if chunk_name:
+                    chunks.append(await asyncio.to_thread(_pop_chunk_file, os.path.join(chunk_dir, chunk_name)))
+            returncode = await proc.wait()
+            stderr = await stderr_task
+        finally:
+            # On errors or cancellation (e.g. the client disconnected), stop ffmpeg before its directory is removed
+            if proc.returncode is None:
+                proc.kill()
+                await proc.wait()
+            stderr_task.cancel()
+
+    if returncode != 0:
+        print("Please ensure FFmpeg is installed and in your system's PATH.")
+        raise RuntimeError(f"ffmpeg failed to extract audio from '{video_uri}': {stderr.decode().strip()}")
+
+    print(f"Audio streamed from '{video_uri}' into {len(chunks)} chunk(s) of up to {chunk_seconds}s")
+    return chunks
+
+def read_text_from_gcs(blob_name: str, max_age: Optional[timedelta] = None) -> Optional[str]:
+    """
+    Reads a text blob from the GCS bucket.
+
+    Args:
+        blob_name (str): The path/name of the blob in GCS.
+        max_age (Optional[timedelta]): If set, blobs created longer ago than this are treated as missing.
+
+    Returns:
+        Optional[str]: The blob's text, or None if the blob does not exist (or is too old).
+    """
+    bucket = storage_client.bucket(GCS_BUCKET_NAME)
+    if max_age is None:
+        blob = bucket.blob(blob_name)
+    else:
+        # Fetches the metadata first, to check the creation time before downloading
+        blob = bucket.get_blob(blob_name)
+        if blob is None or datetime.now(timezone.utc) - blob.time_created > max_age:
+            return None
+    try:
+        return blob.download_as_text()
+    except NotFound:
+        return None
+
+def write_text_to_gcs(text: str, blob_name: str) -> str:
+    """
+    Writes text to a blob in the GCS bucket.
+
+    Args:
+        text (str): The text to store.
+        blob_name (str): The desired path/name for the blob in GCS.
+
+    Returns:
+        str: The GCS URI (gs://bucket-name/blob-name) of the blob.
+    """
+    blob = storage_client.bucket(GCS_BUCKET_NAME).blob(blob_name)
+    blob.upload_from_string(text, content_type="text/plain; charset=utf-8")
+    return f"gs://{GCS_BUCKET_NAME}/{blob_name}"
+
 def delete_gcs_blob(gcs_uri: str):
     """
     Deletes a blob from a Google Cloud Storage bucket.
@@ -95,6 +327,8 @@ def delete_gcs_blob(gcs_uri: str):
 
 # Example usage (for testing this file independently)
 if __name__ == "__main__":
+    import uuid
+
     print("--- Testing utils.py functions ---")
 
     # --- Test GCS Upload/Download/Delete ---